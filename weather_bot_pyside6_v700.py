@@ -1,16 +1,35 @@
 import os
 import sys
 import json
+import time
+import threading
 from datetime import datetime
-from collections import defaultdict
-from typing import Dict, Any, Optional
+from collections import deque, OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from operator import itemgetter
+from typing import Dict, Any, Optional, Callable
 import requests
+from requests.adapters import HTTPAdapter
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
-from PySide6.QtCore import Qt, QRect, QTimer, QPoint, QSize, QThread, Signal, Slot
-from PySide6.QtGui import QFont, QPainter, QLinearGradient, QColor, QIcon, QAction, QShortcut, QKeySequence
+from PySide6.QtCore import Qt, QEvent, QRect, QRectF, QTimer, QSize, QThread, Signal, Slot
+from PySide6.QtGui import QFont, QPainter, QPainterPath, QPixmap, QLinearGradient, QColor, QIcon, QAction, QShortcut, QKeySequence
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QPushButton,
-    QFrame, QGridLayout, QGraphicsDropShadowEffect, QMessageBox, QDialog, QRadioButton,
+    QFrame, QGridLayout, QMessageBox, QDialog, QRadioButton,
     QButtonGroup, QDialogButtonBox, QFileDialog, QToolButton, QMenu, QComboBox
 )
 
@@ -21,8 +40,13 @@ API_URL_AIR = "http://api.openweathermap.org/data/2.5/air_pollution"
 API_URL_IP = "https://ipinfo.io/json"
 DATA_DIR = os.path.join(os.path.expanduser("~"), ".weatherapp_pyside6")
 SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
-CACHE_FILE = os.path.join(DATA_DIR, "weather_cache.json")
+CACHE_FILE = os.path.join(DATA_DIR, "weather_cache.msgpack" if msgpack else "weather_cache.json")
 HISTORY_FILE = os.path.join(DATA_DIR, "history.json")
+HISTORY_MAX = 20
+CACHE_MAX_AGE_MINUTES = 180
+MEM_CACHE_MAX = 64
+FORECAST_DAYS = 5
+GEO_CACHE_FILE = os.path.join(DATA_DIR, "geo_cache.json")
 
 DEFAULT_SETTINGS = {
     "units": "metric",
@@ -35,43 +59,128 @@ DEFAULT_SETTINGS = {
     "history": []
 }
 
+def json_loads(data):
+    if orjson:
+        return orjson.loads(data)
+    if ujson:
+        return ujson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj, indent: bool = False) -> bytes:
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if ujson:
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, indent=2 if indent else 0).encode("utf-8")
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def cache_loads(data):
+    if msgpack:
+        return msgpack.unpackb(data, raw=False)
+    return json_loads(data)
+
+def cache_dumps(obj) -> bytes:
+    if msgpack:
+        return msgpack.packb(obj, use_bin_type=True)
+    return json_dumps(obj)
+
 class Storage:
     def __init__(self):
         os.makedirs(DATA_DIR, exist_ok=True)
+        self.lock = threading.RLock()
         self.settings = DEFAULT_SETTINGS.copy()
-        self.cache: Dict[str, Any] = {}
-        self.history = []
+        self._cache: Optional[Dict[str, Any]] = None
+        self._cache_mtime: Optional[float] = None
+        self._history: Optional[deque] = None
+        self._history_mtime: Optional[float] = None
+        self._history_lower = set()
+        self.geo_cache: Dict[str, Any] = {}
+        self._cache_dirty = False
+        self._history_dirty = False
+        self._geo_dirty = False
         self.load_all()
     def load_all(self):
-        self.settings = self._load(SETTINGS_FILE, DEFAULT_SETTINGS)
-        self.cache = self._load(CACHE_FILE, {})
-        self.history = self._load(HISTORY_FILE, [])
-    def _load(self, path, default):
+        with self.lock:
+            self.settings = self._load(SETTINGS_FILE, DEFAULT_SETTINGS)
+            self._cache = None
+            self._history = None
+            self.geo_cache = self._load(GEO_CACHE_FILE, {})
+    @property
+    def cache(self) -> Dict[str, Any]:
+        with self.lock:
+            mtime = self._mtime(CACHE_FILE)
+            if self._cache is None or (not self._cache_dirty and mtime != self._cache_mtime):
+                self._cache = self._load(CACHE_FILE, {}, cache_loads)
+                self._cache_mtime = mtime
+            return self._cache
+    @property
+    def history(self) -> deque:
+        with self.lock:
+            mtime = self._mtime(HISTORY_FILE)
+            if self._history is None or (not self._history_dirty and mtime != self._history_mtime):
+                self._history = deque(self._load(HISTORY_FILE, [])[:HISTORY_MAX], maxlen=HISTORY_MAX)
+                self._history_lower = {c.lower() for c in self._history}
+                self._history_mtime = mtime
+            return self._history
+    def recent_history(self, n: int) -> list:
+        with self.lock:
+            return list(islice(self.history, n))
+    def _mtime(self, path) -> Optional[float]:
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+    def _load(self, path, default, loads=json_loads):
+        try:
+            with open(path, "rb") as f:
+                return loads(f.read())
         except Exception:
             return default
     def save_settings(self):
-        with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.settings, f, ensure_ascii=False, indent=2)
+        data = json_dumps(self.settings, indent=True)
+        with open(SETTINGS_FILE, "wb") as f:
+            f.write(data)
     def save_cache(self):
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.cache, f, ensure_ascii=False)
+        with self.lock:
+            data = cache_dumps(self.cache)
+            with open(CACHE_FILE, "wb") as f:
+                f.write(data)
+            self._cache_mtime = self._mtime(CACHE_FILE)
     def save_history(self):
-        with open(HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(self.history, f, ensure_ascii=False)
+        with self.lock:
+            data = json_dumps(list(self.history))
+            with open(HISTORY_FILE, "wb") as f:
+                f.write(data)
+            self._history_mtime = self._mtime(HISTORY_FILE)
+    def save_geo_cache(self):
+        with self.lock:
+            data = json_dumps(self.geo_cache)
+            with open(GEO_CACHE_FILE, "wb") as f:
+                f.write(data)
     def add_history(self, city: str):
         city = city.strip()
         if not city:
             return
-        lst = [c for c in self.history if c.lower() != city.lower()]
-        lst.insert(0, city)
-        self.history = lst[:20]
-        self.save_history()
+        with self.lock:
+            history = self.history
+            lc = city.lower()
+            if lc in self._history_lower:
+                for c in history:
+                    if c.lower() == lc:
+                        history.remove(c)
+                        break
+            elif len(history) == history.maxlen:
+                self._history_lower.discard(history[-1].lower())
+            history.appendleft(city)
+            self._history_lower.add(lc)
+            self._history_dirty = True
     def clear_history(self):
-        self.history = []
-        self.save_history()
+        with self.lock:
+            self.history.clear()
+            self._history_lower.clear()
+            self.save_history()
+            self._history_dirty = False
     def add_favorite(self, city: str):
         favs = self.settings.get("favorites", [])
         if city not in favs:
@@ -83,97 +192,303 @@ class Storage:
         self.settings["favorites"] = favs
         self.save_settings()
     def get_cached(self, key: str, ttl_minutes: int) -> Optional[Dict[str, Any]]:
-        item = self.cache.get(key)
-        if not item:
-            return None
-        ts = item.get("ts")
-        if not ts:
-            return None
-        age = (datetime.utcnow().timestamp() - ts) / 60.0
-        if ttl_minutes and age > ttl_minutes:
-            return None
-        return item.get("data")
-    def set_cached(self, key: str, data: Dict[str, Any]):
-        self.cache[key] = {"ts": datetime.utcnow().timestamp(), "data": data}
-        self.save_cache()
+        with self.lock:
+            item = self.cache.get(key)
+            if not item:
+                return None
+            ts = item.get("ts")
+            if not ts or "created" not in item:
+                return None
+            now = time.time()
+            if ttl_minutes and (now - ts) / 60.0 > ttl_minutes:
+                return None
+            if (now - item["created"]) / 60.0 > CACHE_MAX_AGE_MINUTES:
+                return None
+            item["ts"] = now
+            self._cache_dirty = True
+            return item.get("data")
+    def set_cached_many(self, items: Dict[str, Dict[str, Any]]):
+        now = time.time()
+        with self.lock:
+            cache = self.cache
+            for key, data in items.items():
+                cache[key] = {"ts": now, "created": now, "data": data}
+            self._cache_dirty = True
+    def remember_fetch(self, city: str, geo: Dict[str, Any], units: str, wx: Dict[str, Any], aqi: Dict[str, Any]):
+        coord = geo_coord_key(geo)
+        items = {wx_cache_key(coord, units): slim_forecast(wx)}
+        if aqi:
+            items[aqi_cache_key(coord)] = aqi
+        with self.lock:
+            self.set_geo(city, geo)
+            self.set_cached_many(items)
+            self.add_history(city)
+    def get_geo(self, city: str) -> Optional[Dict[str, Any]]:
+        return self.geo_cache.get(city.strip().lower())
+    def set_geo(self, city: str, geo: Dict[str, Any]):
+        key = city.strip().lower()
+        with self.lock:
+            if self.geo_cache.get(key) == geo:
+                return
+            self.geo_cache[key] = geo
+            self._geo_dirty = True
+    def flush_cache(self):
+        with self.lock:
+            if not self._cache_dirty:
+                return
+            self.save_cache()
+            self._cache_dirty = False
+    def flush_history(self):
+        with self.lock:
+            if not self._history_dirty:
+                return
+            self.save_history()
+            self._history_dirty = False
+    def flush_geo_cache(self):
+        with self.lock:
+            if not self._geo_dirty:
+                return
+            self.save_geo_cache()
+            self._geo_dirty = False
+    def flush(self):
+        self.flush_cache()
+        self.flush_history()
+        self.flush_geo_cache()
+
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
 
 def http_get(url: str, params: Dict[str, Any], timeout: int = 10) -> Dict[str, Any]:
-    r = requests.get(url, params=params, timeout=timeout)
+    r = SESSION.get(url, params=params, timeout=timeout)
     if r.status_code == 200:
-        return r.json()
+        return json_loads(r.content)
     if r.status_code == 404:
         raise RuntimeError("شهر پیدا نشد")
     try:
-        msg = r.json().get("message", "")
+        msg = json_loads(r.content).get("message", "")
     except Exception:
         msg = ""
     raise RuntimeError(f"خطای سرویس {r.status_code} {msg}")
 
+EMOJI_BY_GROUP = {2: "⛈️", 3: "🌦️", 5: "🌧️", 6: "❄️", 7: "🌫️"}
+EMOJI_BY_CODE = {
+    (800, False): "☀️", (800, True): "🌙",
+    (801, False): "🌤️", (801, True): "🌥️",
+    (802, False): "⛅", (802, True): "⛅",
+    (803, False): "⛅", (803, True): "⛅",
+    (804, False): "☁️", (804, True): "☁️",
+}
+
+@lru_cache(maxsize=128)
 def weather_emoji(code: int, is_night: bool = False) -> str:
-    if code // 100 == 2: return "⛈️"
-    if code // 100 == 3: return "🌦️"
-    if code // 100 == 5: return "🌧️"
-    if code // 100 == 6: return "❄️"
-    if code // 100 == 7: return "🌫️"
-    if code == 800: return "🌙" if is_night else "☀️"
-    if code == 801: return "🌥️" if is_night else "🌤️"
-    if code in (802, 803): return "⛅"
-    if code == 804: return "☁️"
-    return "🌡️"
-
-def get_day_name_fa(i: int) -> str:
-    d = ["دوشنبه", "سه‌شنبه", "چهارشنبه", "پنج‌شنبه", "جمعه", "شنبه", "یکشنبه"]
-    return d[i]
-
-def format_wind(mps: float, unit: str) -> str:
-    if unit == "mph":
-        return f"{round(mps*2.237)} mph"
-    return f"{round(mps*3.6)} km/h"
+    return EMOJI_BY_GROUP.get(code // 100) or EMOJI_BY_CODE.get((code, is_night), "🌡️")
+
+FA_DAYS = ("دوشنبه", "سه‌شنبه", "چهارشنبه", "پنج‌شنبه", "جمعه", "شنبه", "یکشنبه")
+AQI_LEVELS = {1:"1 (خوب)",2:"2 (قابل قبول)",3:"3 (متوسط)",4:"4 (بد)",5:"5 (خیلی بد)"}
+
+WIND_UNITS = {"kmh": (3.6, "km/h"), "mph": (2.237, "mph")}
+
+def wind_formatter(unit: str) -> Callable[[float], str]:
+    factor, label = WIND_UNITS.get(unit, WIND_UNITS["kmh"])
+    return lambda mps: f"{round(mps*factor)} {label}"
+
+def set_label_text(lbl: QLabel, text: str):
+    if lbl.text() != text:
+        lbl.setText(text)
+
+def fmt_hm(epoch: int) -> str:
+    return f"{(epoch // 3600) % 24:02d}:{(epoch // 60) % 60:02d}"
+
+def fmt_ymd_hm(epoch: int) -> str:
+    return time.strftime("%Y-%m-%d  %H:%M", time.gmtime(epoch))
+
+INFO_FIELDS = (
+    ("زمان محلی", 0, 0, 1),
+    ("دمای محسوس", 1, 0, 1),
+    ("رطوبت", 2, 0, 1),
+    ("فشار", 0, 2, 1),
+    ("سرعت باد", 1, 2, 1),
+    ("طلوع/غروب", 2, 2, 1),
+    ("شاخص کیفیت هوا (AQI)", 3, 0, 3),
+    ("جهت باد", 4, 0, 1),
+)
+AQI_FIELD = 6
+
+MAIN_FIELDS = itemgetter("temp", "feels_like", "humidity", "pressure")
+
+WIND_DIRS = ("↑","↗","→","↘","↓","↙","←","↖")
+WIND_DIR_STEP = 8 / 360.0
 
 def wind_dir_arrow(deg: Optional[float]) -> str:
     if deg is None:
         return ""
-    dirs = ["↑","↗","→","↘","↓","↙","←","↖"]
-    idx = int(((deg % 360) + 22.5) // 45) % 8
-    return dirs[idx]
+    return WIND_DIRS[int(deg * WIND_DIR_STEP + 8.5) & 7]
+
+def geo_coord_key(geo: Dict[str, Any]) -> str:
+    return f"{geo['lat']:.4f},{geo['lon']:.4f}"
+
+def wx_cache_key(coord: str, units: str) -> str:
+    return f"wx::{coord}::{units}"
+
+def aqi_cache_key(coord: str) -> str:
+    return f"aqi::{coord}"
+
+def slim_forecast(wx: Dict[str, Any]) -> Dict[str, Any]:
+    lst = wx.get("list") or []
+    if not lst:
+        return wx
+    rest = [{"dt": it["dt"], "main": {"temp": it["main"]["temp"]}, "weather": [{"id": it["weather"][0]["id"]}]} for it in lst[1:]]
+    return {"city": wx.get("city", {}), "list": [lst[0]] + rest}
+
+PALETTE_LIGHT = {
+    "text": "#111111",
+    "muted": "#3a3a3a",
+    "title": "#0b132b",
+    "card_bg": "rgba(255,255,255,0.92)",
+    "card_border": "rgba(0,0,0,0.12)",
+    "button_bg": "rgba(0,0,0,0.08)",
+    "button_bg_hover": "rgba(0,0,0,0.16)",
+    "button_text": "#111111",
+    "accent_bg": "qlineargradient(x1:0,y1:0,x2:1,y2:1, stop:0 #4b6cb7, stop:1 #182848)",
+    "accent_text": "#ffffff"
+}
+PALETTE_DARK = {
+    "text": "#FFFFFF",
+    "muted": "#C9D6FF",
+    "title": "#EAF2FF",
+    "card_bg": "rgba(255,255,255,0.10)",
+    "card_border": "rgba(255,255,255,0.25)",
+    "button_bg": "rgba(255,255,255,0.12)",
+    "button_bg_hover": "rgba(255,255,255,0.22)",
+    "button_text": "#FFFFFF",
+    "accent_bg": "qlineargradient(x1:0,y1:0,x2:1,y2:1, stop:0 #4b6cb7, stop:1 #182848)",
+    "accent_text": "#ffffff"
+}
+
+def build_stylesheet(t: Dict[str,str]) -> str:
+    return f"""
+QLabel[role="title"] {{ color: {t['title']}; }}
+QLabel[role="text"] {{ color: {t['text']}; }}
+QLabel[role="muted"] {{ color: {t['muted']}; }}
+QLabel[role="day"] {{ color: {t['title']}; font-weight: 700; }}
+QLineEdit[role="search"] {{ border-radius: 12px; padding: 0 14px; background: rgba(255,255,255,0.95); border: 1px solid rgba(0,0,0,0.06); color: #0b132b; selection-background-color: #386fa4; }}
+QPushButton[role="accent"] {{ border-radius: 12px; padding: 0 16px; color: {t['accent_text']}; background: {t['accent_bg']}; font-weight: 600; }}
+QComboBox[role="combo"] {{ border-radius: 10px; padding: 6px 10px; background: rgba(255,255,255,0.9); color: #0b132b; }}
+QToolButton[role="tool"] {{ border-radius: 22px; background: {t['button_bg']}; color: {t['button_text']}; padding: 0 12px; }}
+QToolButton[role="tool"]:hover {{ background: {t['button_bg_hover']}; }}
+QPushButton[role="chip"] {{ border-radius: 10px; padding: 6px 12px; background: {t['button_bg']}; color: {t['button_text']}; }}
+QPushButton[role="chip"]:hover {{ background: {t['button_bg_hover']}; }}
+QFrame#card {{ background: {t['card_bg']}; border: 1px solid {t['card_border']}; border-radius: 20px; }}
+QFrame[role="daily"] {{ background: {t['card_bg']}; border: 1px solid {t['card_border']}; border-radius: 14px; }}
+"""
+
+STYLESHEETS = {"light": build_stylesheet(PALETTE_LIGHT), "dark": build_stylesheet(PALETTE_DARK)}
+
+@lru_cache(maxsize=None)
+def cached_font(family: str, size: int, weight: QFont.Weight = QFont.Normal) -> QFont:
+    return QFont(family, size, weight)
 
 class GradientBackground(QWidget):
+    GRADIENT_COLORS = {
+        "dark": (QColor(24, 43, 73), QColor(77, 91, 129)),
+        "light": (QColor(230, 237, 246), QColor(200, 215, 235)),
+    }
+    SHADOW_COLOR = QColor(0, 0, 0, 18)
+    SHADOW_LAYERS = 8
+    SHADOW_SPREAD = 3
+    SHADOW_OFFSET = 8
+    SHADOW_RADIUS = 20
     def __init__(self, theme: str = "dark"):
         super().__init__()
         self.theme = theme
+        self.shadow_widget: Optional[QWidget] = None
+        self._shadow_rect = QRect()
+        self._shadow: Optional[QPixmap] = None
+        self._gradient: Optional[QLinearGradient] = None
+        self._gradient_key = None
     def paintEvent(self, event):
-        p = QPainter(self)
-        if self.theme == "dark":
-            g = QLinearGradient(0, 0, 0, self.height())
-            g.setColorAt(0.0, QColor(24, 43, 73))
-            g.setColorAt(1.0, QColor(77, 91, 129))
-            p.fillRect(self.rect(), g)
-        else:
+        key = (self.theme, self.height())
+        if key != self._gradient_key:
+            top, bottom = self.GRADIENT_COLORS["dark" if self.theme == "dark" else "light"]
             g = QLinearGradient(0, 0, 0, self.height())
-            g.setColorAt(0.0, QColor(230, 237, 246))
-            g.setColorAt(1.0, QColor(200, 215, 235))
-            p.fillRect(self.rect(), g)
+            g.setColorAt(0.0, top)
+            g.setColorAt(1.0, bottom)
+            self._gradient = g
+            self._gradient_key = key
+        p = QPainter(self)
+        p.fillRect(self.rect(), self._gradient)
+        if self._shadow is not None and self.shadow_widget.isVisible():
+            p.drawPixmap(self.shadow_bounds(self._shadow_rect).topLeft(), self._shadow)
+    def build_shadow(self, r: QRect) -> QPixmap:
+        bounds = self.shadow_bounds(r)
+        dpr = self.devicePixelRatioF()
+        pm = QPixmap(round(bounds.width() * dpr), round(bounds.height() * dpr))
+        pm.setDevicePixelRatio(dpr)
+        pm.fill(Qt.transparent)
+        r = r.translated(-bounds.x(), -bounds.y())
+        p = QPainter(pm)
+        p.setRenderHint(QPainter.Antialiasing)
+        p.setPen(Qt.NoPen)
+        p.setBrush(self.SHADOW_COLOR)
+        card = QPainterPath()
+        card.addRoundedRect(QRectF(r), self.SHADOW_RADIUS, self.SHADOW_RADIUS)
+        base = QRectF(r.translated(0, self.SHADOW_OFFSET))
+        for i in range(self.SHADOW_LAYERS, 0, -1):
+            d = i * self.SHADOW_SPREAD
+            layer = QPainterPath()
+            layer.addRoundedRect(base.adjusted(-d, -d, d, d), self.SHADOW_RADIUS + d, self.SHADOW_RADIUS + d)
+            p.drawPath(layer.subtracted(card))
+        p.end()
+        return pm
+    def set_shadow_widget(self, w: QWidget):
+        self.shadow_widget = w
+        self._shadow_rect = w.geometry()
+        self._shadow = self.build_shadow(self._shadow_rect)
+        w.installEventFilter(self)
+    def shadow_bounds(self, r: QRect) -> QRect:
+        m = self.SHADOW_LAYERS * self.SHADOW_SPREAD + 1
+        return r.translated(0, self.SHADOW_OFFSET).adjusted(-m, -m, m, m)
+    def eventFilter(self, obj, event):
+        if obj is self.shadow_widget and event.type() in (QEvent.Move, QEvent.Resize, QEvent.Show, QEvent.Hide):
+            r = obj.geometry()
+            self.update(self.shadow_bounds(self._shadow_rect))
+            self.update(self.shadow_bounds(r))
+            if r.size() != self._shadow_rect.size():
+                self._shadow = self.build_shadow(r)
+            self._shadow_rect = r
+        return super().eventFilter(obj, event)
 
 class DailyForecastWidget(QFrame):
-    def __init__(self, day_name: str, icon: str, tmax: int, tmin: int, unit: str, colors: Dict[str,str]):
+    def __init__(self, day_name: str, icon: str, tmax: int, tmin: int, unit: str):
         super().__init__()
         self.setFrameShape(QFrame.StyledPanel)
-        self.setStyleSheet(f"QFrame {{background: {colors['card_bg']}; border: 1px solid {colors['card_border']}; border-radius: 14px;}}")
+        self.setProperty("role", "daily")
         lay = QVBoxLayout(self)
         lay.setContentsMargins(10, 10, 10, 10)
         lay.setSpacing(6)
-        self.lbl_day = QLabel(day_name)
+        self.lbl_day = QLabel()
         self.lbl_day.setAlignment(Qt.AlignCenter)
-        self.lbl_day.setStyleSheet(f"color: {colors['title']}; font-weight: 700;")
-        self.lbl_emoji = QLabel(icon)
+        self.lbl_day.setProperty("role", "day")
+        self.lbl_emoji = QLabel()
         self.lbl_emoji.setAlignment(Qt.AlignCenter)
-        self.lbl_emoji.setFont(QFont("Segoe UI Emoji, Noto Color Emoji", 28))
-        self.lbl_temp = QLabel(f"{tmax}° / {tmin}°{unit}")
+        self.lbl_emoji.setFont(cached_font("Segoe UI Emoji, Noto Color Emoji", 28))
+        self.lbl_temp = QLabel()
         self.lbl_temp.setAlignment(Qt.AlignCenter)
-        self.lbl_temp.setStyleSheet(f"color: {colors['text']};")
+        self.lbl_temp.setProperty("role", "text")
         lay.addWidget(self.lbl_day)
         lay.addWidget(self.lbl_emoji)
         lay.addWidget(self.lbl_temp)
+        self.data: Optional[tuple] = None
+        self.set_data(day_name, icon, tmax, tmin, unit)
+    def set_data(self, day_name: str, icon: str, tmax: int, tmin: int, unit: str):
+        data = (day_name, icon, tmax, tmin, unit)
+        if data == self.data:
+            return
+        self.data = data
+        set_label_text(self.lbl_day, day_name)
+        set_label_text(self.lbl_emoji, icon)
+        set_label_text(self.lbl_temp, f"{tmax}° / {tmin}°{unit}")
 
 class SettingsDialog(QDialog):
     def __init__(self, settings: Dict[str, Any], parent=None):
@@ -251,30 +566,43 @@ class SettingsDialog(QDialog):
         super().accept()
 
 class FetchWorker(QThread):
-    done = Signal(dict, dict, dict)
+    done = Signal(object)
     failed = Signal(str)
-    def __init__(self, city: str, units: str, show_aqi: bool):
+    def __init__(self, storage: Storage, city: str, units: str, show_aqi: bool, geo: Optional[dict] = None, geo_only: bool = False):
         super().__init__()
+        self.storage = storage
         self.city = city
         self.units = units
         self.show_aqi = show_aqi
+        self.geo = geo
+        self.geo_only = geo_only
     def run(self):
         try:
-            g = http_get(API_URL_GEO, {"q": self.city, "limit": 1, "appid": API_KEY})
-            if not g:
-                raise RuntimeError("شهر یافت نشد")
-            item = g[0]
-            lat = float(item["lat"]) ; lon = float(item["lon"]) ; name = item.get("name","") ; country = item.get("country","")
-            wx = http_get(API_URL_FORECAST, {"lat": lat, "lon": lon, "appid": API_KEY, "units": self.units, "lang": "fa"})
-            aqi = {}
-            if self.show_aqi:
-                try:
-                    aqi = http_get(API_URL_AIR, {"lat": lat, "lon": lon, "appid": API_KEY})
-                except Exception:
-                    aqi = {}
-            self.done.emit({"name": name, "country": country, "lat": lat, "lon": lon}, wx, aqi)
+            geo = self.geo or self.lookup_geo()
+            if self.geo_only:
+                self.done.emit({"city": self.city, "geo": geo})
+                return
+            lat = geo["lat"] ; lon = geo["lon"]
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                f_wx = pool.submit(http_get, API_URL_FORECAST, {"lat": lat, "lon": lon, "appid": API_KEY, "units": self.units, "lang": "fa"})
+                f_aqi = pool.submit(self.fetch_aqi, lat, lon) if self.show_aqi else None
+                wx = f_wx.result()
+                aqi = f_aqi.result() if f_aqi else {}
+            self.storage.remember_fetch(self.city, geo, self.units, wx, aqi)
+            self.done.emit({"city": self.city, "geo": geo, "units": self.units, "wx": wx, "aqi": aqi})
         except Exception as e:
             self.failed.emit(str(e))
+    def lookup_geo(self) -> Dict[str, Any]:
+        g = http_get(API_URL_GEO, {"q": self.city, "limit": 1, "appid": API_KEY})
+        if not g:
+            raise RuntimeError("شهر یافت نشد")
+        item = g[0]
+        return {"name": item.get("name",""), "country": item.get("country",""), "lat": float(item["lat"]), "lon": float(item["lon"])}
+    def fetch_aqi(self, lat: float, lon: float) -> Dict[str, Any]:
+        try:
+            return http_get(API_URL_AIR, {"lat": lat, "lon": lon, "appid": API_KEY})
+        except Exception:
+            return {}
 
 class IpCityWorker(QThread):
     found = Signal(str)
@@ -293,98 +621,78 @@ class WeatherApp(GradientBackground):
     def __init__(self, storage: Storage):
         super().__init__(theme=storage.settings.get("theme","dark"))
         self.storage = storage
+        self.detect_ip_and_fetch()
         self.setLayoutDirection(Qt.RightToLeft)
         self.setWindowTitle("ربات هواشناسی")
         self.setMinimumSize(900, 900)
-        self.colors = {}
         self.current_city = ""
         self.current_geo: Optional[dict] = None
         self.current_weather: Optional[dict] = None
         self.current_aqi: Optional[dict] = None
+        self.mem_cache: "OrderedDict[str, tuple]" = OrderedDict()
         self.auto_timer = QTimer(self)
         self.auto_timer.timeout.connect(self.refresh_current)
+        self.flush_timer = QTimer(self)
+        self.flush_timer.setInterval(5000)
+        self.flush_timer.timeout.connect(self.storage.flush)
+        self.flush_timer.start()
+        self.rebind_formatters()
+        self.geo_worker: Optional[FetchWorker] = None
+        self.geo_prefetch: "OrderedDict[str, dict]" = OrderedDict()
+        self.geo_timer = QTimer(self)
+        self.geo_timer.setSingleShot(True)
+        self.geo_timer.setInterval(300)
+        self.geo_timer.timeout.connect(self.prefetch_geo)
         self.build_ui()
         self.apply_theme()
+        self.refresh_favorites_ui()
+        self.update_fav_button_text()
         self.update_auto_refresh_timer()
-        QTimer.singleShot(0, self.detect_ip_and_fetch)
+        self.status_lbl.setText("در حال تشخیص موقعیت مکانی…")
         self.install_shortcuts()
-    def theme_palette(self, name: str) -> Dict[str,str]:
-        if name == "light":
-            return {
-                "text": "#111111",
-                "muted": "#3a3a3a",
-                "title": "#0b132b",
-                "card_bg": "rgba(255,255,255,0.92)",
-                "card_border": "rgba(0,0,0,0.12)",
-                "button_bg": "rgba(0,0,0,0.08)",
-                "button_bg_hover": "rgba(0,0,0,0.16)",
-                "button_text": "#111111",
-                "accent_bg": "qlineargradient(x1:0,y1:0,x2:1,y2:1, stop:0 #4b6cb7, stop:1 #182848)",
-                "accent_text": "#ffffff"
-            }
-        return {
-            "text": "#FFFFFF",
-            "muted": "#C9D6FF",
-            "title": "#EAF2FF",
-            "card_bg": "rgba(255,255,255,0.10)",
-            "card_border": "rgba(255,255,255,0.25)",
-            "button_bg": "rgba(255,255,255,0.12)",
-            "button_bg_hover": "rgba(255,255,255,0.22)",
-            "button_text": "#FFFFFF",
-            "accent_bg": "qlineargradient(x1:0,y1:0,x2:1,y2:1, stop:0 #4b6cb7, stop:1 #182848)",
-            "accent_text": "#ffffff"
-        }
     def choose_auto_theme(self) -> str:
         if self.current_weather and self.current_weather.get("city"):
             city = self.current_weather["city"]
-            tz_offset = int(city.get("timezone", 0))
             sunrise = int(city.get("sunrise", 0))
             sunset = int(city.get("sunset", 0))
             cur = (self.current_weather.get("list") or [{}])[0]
             dt_utc = int(cur.get("dt", 0))
-            local_dt = datetime.utcfromtimestamp(dt_utc + tz_offset)
-            sr_local = datetime.utcfromtimestamp(sunrise + tz_offset) if sunrise else local_dt
-            ss_local = datetime.utcfromtimestamp(sunset + tz_offset) if sunset else local_dt
-            day = sr_local.time() <= local_dt.time() <= ss_local.time()
+            day = sunrise <= dt_utc <= sunset if sunrise and sunset else True
             return "light" if day else "dark"
         h = datetime.now().hour
         return "light" if 8 <= h <= 18 else "dark"
-    def apply_theme(self):
+    def resolve_theme(self) -> str:
         tset = self.storage.settings.get("theme","dark")
         if tset == "auto":
-            self.theme = self.choose_auto_theme()
-        else:
-            self.theme = tset
-        self.colors = self.theme_palette(self.theme)
+            return self.choose_auto_theme()
+        return tset
+    def apply_theme(self):
+        self.theme = self.resolve_theme()
         self.update()
-        t = self.colors
-        self.title_lbl.setStyleSheet(f"color: {t['title']};")
-        self.city_edit.setStyleSheet("QLineEdit {border-radius: 12px; padding: 0 14px; background: rgba(255,255,255,0.95); border: 1px solid rgba(0,0,0,0.06); color: #0b132b; selection-background-color: #386fa4;}")
-        self.btn_search.setStyleSheet(f"QPushButton {{border-radius: 12px; padding: 0 16px; color: {t['accent_text']}; background: {t['accent_bg']}; font-weight: 600;}} QPushButton:hover {{ filter: brightness(1.05); }}")
-        self.theme_label.setStyleSheet(f"color: {t['title']};")
-        self.theme_combo.setStyleSheet("QComboBox {border-radius: 10px; padding: 6px 10px; background: rgba(255,255,255,0.9); color: #0b132b;}")
+        self.setStyleSheet(STYLESHEETS["light" if self.theme == "light" else "dark"])
+    def tag_roles(self):
+        self.title_lbl.setProperty("role", "title")
+        self.theme_label.setProperty("role", "title")
+        self.city_lbl.setProperty("role", "title")
+        self.desc_lbl.setProperty("role", "muted")
+        self.icon_lbl.setProperty("role", "text")
+        self.temp_lbl.setProperty("role", "text")
+        self.city_edit.setProperty("role", "search")
+        self.btn_search.setProperty("role", "accent")
+        self.theme_combo.setProperty("role", "combo")
         for b in (self.btn_refresh, self.btn_settings, self.btn_more, self.btn_history):
-            b.setStyleSheet(f"QToolButton {{ border-radius: 22px; background: {t['button_bg']}; color: {t['button_text']}; padding: 0 12px;}} QToolButton:hover {{background: {t['button_bg_hover']};}}")
-        self.card.setStyleSheet(f"QFrame#card {{background: {t['card_bg']}; border: 1px solid {t['card_border']}; border-radius: 20px;}}")
-        self.icon_lbl.setStyleSheet(f"color: {t['text']};")
-        self.temp_lbl.setStyleSheet(f"color: {t['text']};")
-        self.city_lbl.setStyleSheet(f"color: {t['title']};")
-        self.desc_lbl.setStyleSheet(f"color: {t['muted']};")
-        for k in [self.k1,self.k2,self.k3,self.k4,self.k5,self.k6,self.k7,self.k8]:
-            k.setStyleSheet(f"color: {t['title']};")
-        for v in [self.v1,self.v2,self.v3,self.v4,self.v5,self.v6,self.v7,self.v8,self.status_lbl,self.updated_lbl]:
-            v.setStyleSheet(f"color: {t['text']};")
-        self.refresh_favorites_ui()
-        self.refresh_daily_theme()
-        self.update_fav_button_text()
-        self.refresh_history_menu()
+            b.setProperty("role", "tool")
+        for k in self.k:
+            k.setProperty("role", "title")
+        for v in [*self.v, self.status_lbl, self.updated_lbl]:
+            v.setProperty("role", "text")
     def build_ui(self):
         root = QVBoxLayout(self)
         root.setContentsMargins(24, 24, 24, 24)
         root.setSpacing(16)
         top = QHBoxLayout()
         self.title_lbl = QLabel("ربات هواشناسی")
-        self.title_lbl.setFont(QFont("Vazirmatn, Segoe UI, Arial", 22, QFont.DemiBold))
+        self.title_lbl.setFont(cached_font("Vazirmatn, Segoe UI, Arial", 22, QFont.DemiBold))
         self.btn_refresh = QToolButton(); self.btn_refresh.setText("به روز رسانی"); self.btn_refresh.setToolTip("به روز رسانی")
         self.btn_refresh.setFixedHeight(44)
         self.btn_refresh.clicked.connect(self.refresh_current)
@@ -399,6 +707,7 @@ class WeatherApp(GradientBackground):
         self.btn_history = QToolButton(); self.btn_history.setText("تاریخچه")
         self.btn_history.setPopupMode(QToolButton.InstantPopup)
         self.history_menu = QMenu(self)
+        self.history_menu.aboutToShow.connect(self.refresh_history_menu)
         self.btn_history.setMenu(self.history_menu)
         top.addWidget(self.title_lbl)
         top.addStretch(1)
@@ -410,6 +719,7 @@ class WeatherApp(GradientBackground):
         root.addLayout(top)
         search = QHBoxLayout()
         self.city_edit = QLineEdit(); self.city_edit.setPlaceholderText("نام شهر را وارد کنید…"); self.city_edit.returnPressed.connect(self.fetch_and_render)
+        self.city_edit.textEdited.connect(lambda _: self.geo_timer.start())
         self.btn_search = QPushButton("جستجو"); self.btn_search.clicked.connect(self.fetch_and_render)
         self.city_edit.setMinimumHeight(44); self.btn_search.setMinimumHeight(44)
         search.addWidget(self.city_edit,1)
@@ -421,14 +731,13 @@ class WeatherApp(GradientBackground):
         self.fav_bar = QHBoxLayout(); fav.addLayout(self.fav_bar,1); fav.addStretch(1)
         root.addLayout(fav)
         self.card = QFrame(); self.card.setObjectName("card")
-        sh = QGraphicsDropShadowEffect(self.card, blurRadius=24, xOffset=0, yOffset=8)
-        sh.setColor(QColor(0,0,0,160)); self.card.setGraphicsEffect(sh)
+        self.set_shadow_widget(self.card)
         card_box = QVBoxLayout(self.card); card_box.setContentsMargins(20,20,20,20); card_box.setSpacing(12)
         top_card = QHBoxLayout()
-        self.icon_lbl = QLabel("—"); self.icon_lbl.setFont(QFont("Segoe UI Emoji, Noto Color Emoji, Arial", 48))
-        self.temp_lbl = QLabel("—°"); self.temp_lbl.setFont(QFont("Vazirmatn, Segoe UI, Arial", 46, QFont.Bold))
-        info_box = QVBoxLayout(); self.city_lbl = QLabel("ربات هواشناسی"); self.city_lbl.setFont(QFont("Vazirmatn, Segoe UI, Arial", 16, QFont.DemiBold))
-        self.desc_lbl = QLabel(""); self.desc_lbl.setFont(QFont("Vazirmatn, Segoe UI, Arial", 12))
+        self.icon_lbl = QLabel("—"); self.icon_lbl.setFont(cached_font("Segoe UI Emoji, Noto Color Emoji, Arial", 48))
+        self.temp_lbl = QLabel("—°"); self.temp_lbl.setFont(cached_font("Vazirmatn, Segoe UI, Arial", 46, QFont.Bold))
+        info_box = QVBoxLayout(); self.city_lbl = QLabel("ربات هواشناسی"); self.city_lbl.setFont(cached_font("Vazirmatn, Segoe UI, Arial", 16, QFont.DemiBold))
+        self.desc_lbl = QLabel(""); self.desc_lbl.setFont(cached_font("Vazirmatn, Segoe UI, Arial", 12))
         info_box.addWidget(self.city_lbl); info_box.addWidget(self.desc_lbl)
         self.btn_more = QToolButton(); self.btn_more.setText("⋯"); self.btn_more.setFixedSize(36,36)
         m = QMenu();
@@ -442,29 +751,23 @@ class WeatherApp(GradientBackground):
         grid = QGridLayout(); grid.setHorizontalSpacing(18); grid.setVerticalSpacing(10)
         def mk(k:str):
             kk = QLabel(k); vv = QLabel("—")
-            kk.setFont(QFont("Vazirmatn, Segoe UI, Arial", 11, QFont.Medium))
-            vv.setFont(QFont("Vazirmatn, Segoe UI, Arial", 12, QFont.DemiBold))
+            kk.setFont(cached_font("Vazirmatn, Segoe UI, Arial", 11, QFont.Medium))
+            vv.setFont(cached_font("Vazirmatn, Segoe UI, Arial", 12, QFont.DemiBold))
             return kk, vv
-        self.k1,self.v1 = mk("زمان محلی")
-        self.k2,self.v2 = mk("دمای محسوس")
-        self.k3,self.v3 = mk("رطوبت")
-        self.k4,self.v4 = mk("فشار")
-        self.k5,self.v5 = mk("سرعت باد")
-        self.k6,self.v6 = mk("طلوع/غروب")
-        self.k7,self.v7 = mk("شاخص کیفیت هوا (AQI)")
-        self.k8,self.v8 = mk("جهت باد")
-        grid.addWidget(self.k1,0,0); grid.addWidget(self.v1,0,1)
-        grid.addWidget(self.k2,1,0); grid.addWidget(self.v2,1,1)
-        grid.addWidget(self.k3,2,0); grid.addWidget(self.v3,2,1)
-        grid.addWidget(self.k4,0,2); grid.addWidget(self.v4,0,3)
-        grid.addWidget(self.k5,1,2); grid.addWidget(self.v5,1,3)
-        grid.addWidget(self.k6,2,2); grid.addWidget(self.v6,2,3)
-        grid.addWidget(self.k7,3,0); grid.addWidget(self.v7,3,1,1,3)
-        grid.addWidget(self.k8,4,0); grid.addWidget(self.v8,4,1)
+        self.k, self.v = [], []
+        for text, row, col, span in INFO_FIELDS:
+            kk, vv = mk(text)
+            grid.addWidget(kk,row,col); grid.addWidget(vv,row,col+1,1,span)
+            self.k.append(kk); self.v.append(vv)
+        self.aqi_lbl = self.v[AQI_FIELD]
         card_box.addLayout(grid)
         self.card_wrap = self.card
         root.addWidget(self.card_wrap)
         self.daily_wrap = QHBoxLayout(); root.addLayout(self.daily_wrap)
+        self.daily_widgets = [DailyForecastWidget("", "", 0, 0, "C") for _ in range(FORECAST_DAYS)]
+        for w in self.daily_widgets:
+            w.hide()
+            self.daily_wrap.addWidget(w)
         bottom = QHBoxLayout()
         self.updated_lbl = QLabel("")
         self.status_lbl = QLabel("")
@@ -472,6 +775,11 @@ class WeatherApp(GradientBackground):
         bottom.addStretch(1)
         bottom.addWidget(self.status_lbl)
         root.addLayout(bottom)
+        self.tag_roles()
+    def closeEvent(self, event):
+        self.flush_timer.stop()
+        self.storage.flush()
+        super().closeEvent(event)
     def install_shortcuts(self):
         QShortcut(QKeySequence("Ctrl+F"), self, activated=self.focus_search)
         QShortcut(QKeySequence("Ctrl+R"), self, activated=self.refresh_current)
@@ -489,26 +797,15 @@ class WeatherApp(GradientBackground):
         while self.fav_bar.count():
             it = self.fav_bar.takeAt(0)
             if it.widget(): it.widget().deleteLater()
-        t = self.colors
         for city in self.storage.settings.get("favorites", [])[:20]:
-            row = QHBoxLayout()
             b_city = QPushButton(city)
-            b_city.setStyleSheet(f"QPushButton {{ border-radius: 10px; padding: 6px 12px; background: {t['button_bg']}; color: {t['button_text']};}} QPushButton:hover {{background: {t['button_bg_hover']};}}")
+            b_city.setProperty("role", "chip")
             b_city.clicked.connect(lambda _,c=city: self.search_city(c))
             b_del = QPushButton("حذف")
-            b_del.setStyleSheet(f"QPushButton {{ border-radius: 10px; padding: 6px 12px; background: {t['button_bg']}; color: {t['button_text']};}} QPushButton:hover {{background: {t['button_bg_hover']};}}")
+            b_del.setProperty("role", "chip")
             b_del.clicked.connect(lambda _,c=city: self.remove_favorite(c))
             w = QWidget(); lr = QHBoxLayout(w); lr.setContentsMargins(0,0,0,0); lr.setSpacing(6); lr.addWidget(b_city); lr.addWidget(b_del)
             self.fav_bar.addWidget(w)
-    def refresh_daily_theme(self):
-        for i in range(self.daily_wrap.count()):
-            it = self.daily_wrap.itemAt(i)
-            if it and it.widget() and isinstance(it.widget(), DailyForecastWidget):
-                w = it.widget()
-                c = self.colors
-                w.setStyleSheet(f"QFrame {{background: {c['card_bg']}; border: 1px solid {c['card_border']}; border-radius: 14px;}}")
-                w.lbl_day.setStyleSheet(f"color: {c['title']}; font-weight: 700;")
-                w.lbl_temp.setStyleSheet(f"color: {c['text']};")
     def update_fav_button_text(self):
         if not self.current_city:
             self.btn_add_fav.setText("⭐ افزودن به علاقمندی‌ها")
@@ -520,12 +817,13 @@ class WeatherApp(GradientBackground):
             self.btn_add_fav.setText("⭐ افزودن به علاقمندی‌ها")
     def refresh_history_menu(self):
         self.history_menu.clear()
-        if not self.storage.history:
+        recent = self.storage.recent_history(10)
+        if not recent:
             a = QAction("تاریخچه خالی است", self)
             a.setEnabled(False)
             self.history_menu.addAction(a)
         else:
-            for city in self.storage.history[:10]:
+            for city in recent:
                 act = QAction(city, self)
                 act.triggered.connect(lambda _,c=city: self.search_city(c))
                 self.history_menu.addAction(act)
@@ -534,20 +832,34 @@ class WeatherApp(GradientBackground):
         act_clear.triggered.connect(self.clear_history)
         self.history_menu.addAction(act_clear)
     def on_theme_changed(self, idx: int):
-        self.storage.settings["theme"] = "auto" if idx==2 else ("light" if idx==1 else "dark")
+        theme = "auto" if idx==2 else ("light" if idx==1 else "dark")
+        if theme == self.storage.settings.get("theme"):
+            return
+        self.storage.settings["theme"] = theme
         self.storage.save_settings()
         self.apply_theme()
     def open_settings(self):
         dlg = SettingsDialog(self.storage.settings, self)
         if dlg.exec():
-            self.storage.settings = dlg.settings
+            old = self.storage.settings
+            new = dlg.settings
+            self.storage.settings = new
             self.storage.save_settings()
-            self.apply_theme()
-            self.update_auto_refresh_timer()
-            if self.current_city:
-                self.fetch_and_render(force_refresh=True)
+            self.rebind_formatters()
+            changed = lambda k: old.get(k) != new.get(k)
+            if changed("theme"):
+                self.apply_theme()
+            if changed("auto_refresh_minutes"):
+                self.update_auto_refresh_timer()
+            if self.current_city and (changed("units") or changed("show_aqi")):
+                self.fetch_and_render()
+            elif self.current_weather and changed("wind_speed_unit"):
+                self.render_current(self.current_weather)
+    def rebind_formatters(self):
+        settings = self.storage.settings
+        self.temp_unit = "C" if settings.get("units") == "metric" else "F"
+        self.wind_fmt = wind_formatter(settings.get("wind_speed_unit", "kmh"))
     def detect_ip_and_fetch(self):
-        self.status_lbl.setText("در حال تشخیص موقعیت مکانی…")
         self.ip_thread = IpCityWorker()
         self.ip_thread.found.connect(self.on_ip_found)
         self.ip_thread.failed.connect(self.on_ip_failed)
@@ -576,7 +888,6 @@ class WeatherApp(GradientBackground):
         self.update_fav_button_text()
     def clear_history(self):
         self.storage.clear_history()
-        self.refresh_history_menu()
     def copy_summary(self):
         if not self.current_weather:
             return
@@ -586,34 +897,62 @@ class WeatherApp(GradientBackground):
         cur = (self.current_weather.get("list") or [{}])[0]
         main = cur.get("main", {})
         weather = (cur.get("weather") or [{}])[0]
-        temp_unit = "°C" if self.storage.settings.get("units") == "metric" else "°F"
         t = round(main.get("temp", 0))
         desc = weather.get("description", "")
-        QApplication.clipboard().setText(f"هوا در {name}{('، ' + country) if country else ''}: {t}{temp_unit} — {desc}")
+        QApplication.clipboard().setText(f"هوا در {name}{('، ' + country) if country else ''}: {t}°{self.temp_unit} — {desc}")
     def copy_json_status(self):
         if not self.current_weather:
             return
         try:
             cur = (self.current_weather.get("list") or [{}])[0]
-            QApplication.clipboard().setText(json.dumps(cur, ensure_ascii=False))
+            QApplication.clipboard().setText(json_dumps(cur).decode("utf-8"))
         except Exception:
             pass
     def export_card_png(self):
         path, _ = QFileDialog.getSaveFileName(self, "ذخیرهٔ تصویر کارت", "weather_card.png", "PNG (*.png)")
         if not path:
             return
-        pix = self.grab()
-        card = self.card
-        r = card.geometry()
-        top_left = card.mapTo(self, QPoint(0,0))
-        crop = pix.copy(QRect(top_left, r.size()))
-        crop.save(path, "PNG")
+        self.grab(self.card.geometry()).save(path, "PNG")
     def refresh_current(self):
         if self.current_city:
             self.fetch_and_render(force_refresh=True)
     def search_city(self, city: str):
         self.city_edit.setText(city)
         self.fetch_and_render()
+    def mem_get(self, key: str, ttl_minutes: int) -> Optional[Dict[str, Any]]:
+        item = self.mem_cache.get(key)
+        if item is not None:
+            ts, value = item
+            if time.monotonic() - ts < (ttl_minutes or CACHE_MAX_AGE_MINUTES) * 60:
+                self.mem_cache.move_to_end(key)
+                return value
+            del self.mem_cache[key]
+        value = self.storage.get_cached(key, ttl_minutes)
+        if value is not None:
+            self.mem_put(key, value)
+        return value
+    def mem_put(self, key: str, value: Dict[str, Any]):
+        self.mem_cache[key] = (time.monotonic(), value)
+        self.mem_cache.move_to_end(key)
+        while len(self.mem_cache) > MEM_CACHE_MAX:
+            self.mem_cache.popitem(last=False)
+    def lookup_geo(self, city: str) -> Optional[Dict[str, Any]]:
+        return self.storage.get_geo(city) or self.geo_prefetch.get(city.strip().lower())
+    def prefetch_geo(self):
+        city = self.city_edit.text().strip()
+        if not city or not API_KEY or self.lookup_geo(city):
+            return
+        if self.geo_worker and self.geo_worker.isRunning():
+            self.geo_timer.start()
+            return
+        self.geo_worker = FetchWorker(self.storage, city, "", False, geo_only=True)
+        self.geo_worker.done.connect(self.on_geo_prefetched)
+        self.geo_worker.start()
+    @Slot(object)
+    def on_geo_prefetched(self, result: Dict[str, Any]):
+        self.geo_prefetch[result["city"].strip().lower()] = result["geo"]
+        while len(self.geo_prefetch) > MEM_CACHE_MAX:
+            self.geo_prefetch.popitem(last=False)
     def fetch_and_render(self, force_refresh: bool = False):
         city = self.city_edit.text().strip()
         if not city:
@@ -625,22 +964,21 @@ class WeatherApp(GradientBackground):
         self.btn_search.setText("در حال دریافت…")
         QApplication.setOverrideCursor(Qt.WaitCursor)
         try:
-            units = self.storage.settings.get("units","metric")
-            ttl = 0 if force_refresh else self.storage.settings.get("cache_ttl_minutes",20)
-            geo_key = f"geo::{city.lower()}"
-            geo = self.storage.get_cached(geo_key, 1440)
+            settings = self.storage.settings
+            units = settings.get("units","metric")
+            show_aqi = settings.get("show_aqi",True)
+            geo = self.lookup_geo(city)
             wx = None
             aqi = None
-            if geo:
-                w_key = f"wx::{geo['lat']:.4f},{geo['lon']:.4f}::{units}"
-                wx = self.storage.get_cached(w_key, ttl)
-                if self.storage.settings.get("show_aqi",True):
-                    a_key = f"aqi::{geo['lat']:.4f},{geo['lon']:.4f}"
-                    aqi = self.storage.get_cached(a_key, 60)
-            if wx and (aqi or not self.storage.settings.get("show_aqi",True)):
-                self.on_fetch_done(geo, wx, aqi or {})
+            if geo and not force_refresh:
+                coord = geo_coord_key(geo)
+                wx = self.mem_get(wx_cache_key(coord, units), settings.get("cache_ttl_minutes",20))
+                if wx and show_aqi:
+                    aqi = self.mem_get(aqi_cache_key(coord), 60)
+            if wx and (aqi or not show_aqi):
+                self.on_fetch_done({"city": city, "geo": geo, "units": units, "wx": wx, "aqi": aqi or {}, "cached": True})
             else:
-                self.worker = FetchWorker(city, units, self.storage.settings.get("show_aqi",True))
+                self.worker = FetchWorker(self.storage, city, units, show_aqi, geo)
                 self.worker.done.connect(self.on_fetch_done)
                 self.worker.failed.connect(self.on_fetch_failed)
                 self.worker.finished.connect(self.on_worker_finished)
@@ -654,116 +992,124 @@ class WeatherApp(GradientBackground):
         QApplication.restoreOverrideCursor()
         self.btn_search.setEnabled(True)
         self.btn_search.setText("جستجو")
-    @Slot(dict, dict, dict)
-    def on_fetch_done(self, geo: dict, wx: dict, aqi: dict):
+    @Slot(object)
+    def on_fetch_done(self, result: Dict[str, Any]):
         self.on_worker_finished()
-        city = self.city_edit.text().strip()
-        self.storage.set_cached(f"geo::{city.lower()}", geo)
-        units = self.storage.settings.get("units","metric")
-        self.storage.set_cached(f"wx::{geo['lat']:.4f},{geo['lon']:.4f}::{units}", wx)
-        if self.storage.settings.get("show_aqi",True) and aqi:
-            self.storage.set_cached(f"aqi::{geo['lat']:.4f},{geo['lon']:.4f}", aqi)
-        self.storage.add_history(city)
+        city, geo, wx, aqi = result["city"], result["geo"], result["wx"], result["aqi"]
+        if not self.render_current(wx):
+            return
+        units = result["units"]
+        if result.get("cached"):
+            self.storage.add_history(city)
+        else:
+            coord = geo_coord_key(geo)
+            self.mem_put(wx_cache_key(coord, units), wx)
+            if aqi:
+                self.mem_put(aqi_cache_key(coord), aqi)
         self.current_city = city
         self.current_geo = geo
         self.current_weather = wx
         self.current_aqi = aqi
-        self.apply_theme()
-        self.render_current(wx)
+        if self.resolve_theme() != self.theme:
+            self.apply_theme()
         self.render_daily(wx)
         self.render_aqi(aqi)
         self.update_fav_button_text()
-        self.updated_lbl.setText("آخرین به‌روزرسانی: " + datetime.now().strftime("%H:%M"))
-        self.status_lbl.setText("")
-        self.refresh_history_menu()
+        set_label_text(self.updated_lbl, "آخرین به‌روزرسانی: " + datetime.now().strftime("%H:%M"))
+        set_label_text(self.status_lbl, "")
     @Slot(str)
     def on_fetch_failed(self, err: str):
         self.on_worker_finished()
         QMessageBox.critical(self, "خطا", err)
         self.clear_ui_on_error()
-    def render_current(self, j: Dict[str, Any]):
-        city_info = j.get("city", {})
-        name = city_info.get("name", "")
-        country = city_info.get("country", "")
-        tz_offset = int(city_info.get("timezone", 0))
-        sunrise = int(city_info.get("sunrise", 0))
-        sunset = int(city_info.get("sunset", 0))
-        cur = (j.get("list") or [{}])[0]
-        weather = (cur.get("weather") or [{}])[0]
-        main = cur.get("main", {})
-        wind = cur.get("wind", {})
-        dt_utc = int(cur.get("dt", 0))
-        local_dt = datetime.utcfromtimestamp(dt_utc + tz_offset)
-        sr_local = datetime.utcfromtimestamp(sunrise + tz_offset) if sunrise else local_dt
-        ss_local = datetime.utcfromtimestamp(sunset + tz_offset) if sunset else local_dt
-        is_night = not (sr_local.time() <= local_dt.time() <= ss_local.time())
-        code = int(weather.get("id", 800))
+    def render_current(self, j: Dict[str, Any]) -> bool:
+        try:
+            city_info = j["city"]
+            cur = j["list"][0]
+            weather = cur["weather"][0]
+            temp, feels, humidity, pressure = MAIN_FIELDS(cur["main"])
+            temp, feels = round(temp), round(feels)
+            wind = cur["wind"]
+            name = city_info["name"]
+            country = city_info.get("country", "")
+            tz_offset = int(city_info["timezone"])
+            sunrise = int(city_info["sunrise"])
+            sunset = int(city_info["sunset"])
+            dt_utc = int(cur["dt"])
+            code = int(weather["id"])
+            wind_speed_val = float(wind["speed"])
+        except (KeyError, IndexError, TypeError, ValueError):
+            self.clear_ui_on_error()
+            return False
+        local_epoch = dt_utc + tz_offset
+        sr_epoch = sunrise + tz_offset if sunrise else local_epoch
+        ss_epoch = sunset + tz_offset if sunset else local_epoch
+        is_night = not (sunrise <= dt_utc <= sunset) if sunrise and sunset else False
         emoji = weather_emoji(code, is_night=is_night)
-        temp = round(main.get("temp", 0))
-        feels = round(main.get("feels_like", 0))
-        humidity = main.get("humidity", 0)
-        pressure = main.get("pressure", 0)
-        wind_speed_val = float(wind.get("speed", 0.0))
         wind_deg = wind.get("deg")
-        temp_unit = "C" if self.storage.settings.get("units") == "metric" else "F"
-        wind_unit = self.storage.settings.get("wind_speed_unit", "kmh")
-        self.icon_lbl.setText(emoji)
-        self.temp_lbl.setText(f"{temp}°")
         city_title = f"{name}، {country}" if country else name
-        self.city_lbl.setText(city_title)
-        self.desc_lbl.setText(weather.get("description", ""))
-        self.v1.setText(local_dt.strftime("%Y-%m-%d  %H:%M"))
-        self.v2.setText(f"{feels}°{temp_unit}")
-        self.v3.setText(f"{humidity}%")
-        self.v4.setText(f"{pressure} hPa")
-        self.v5.setText(format_wind(wind_speed_val, wind_unit))
-        self.v6.setText(f"{sr_local.strftime('%H:%M')} / {ss_local.strftime('%H:%M')}")
-        self.v8.setText(wind_dir_arrow(wind_deg))
+        set_label_text(self.icon_lbl, emoji)
+        set_label_text(self.temp_lbl, f"{temp}°")
+        set_label_text(self.city_lbl, city_title)
+        set_label_text(self.desc_lbl, weather.get("description", ""))
+        texts = (fmt_ymd_hm(local_epoch), f"{feels}°{self.temp_unit}", f"{humidity}%", f"{pressure} hPa",
+                 self.wind_fmt(wind_speed_val), f"{fmt_hm(sr_epoch)} / {fmt_hm(ss_epoch)}", None, wind_dir_arrow(wind_deg))
+        for lbl, text in zip(self.v, texts):
+            if text is not None:
+                set_label_text(lbl, text)
+        return True
+    def hide_daily(self):
+        for w in self.daily_widgets:
+            w.hide()
     def render_daily(self, j: Dict[str, Any]):
-        while self.daily_wrap.count():
-            it = self.daily_wrap.takeAt(0)
-            if it.widget(): it.widget().deleteLater()
         lst = j.get("list", [])
         if not lst:
+            self.hide_daily()
             return
         tz = int(j.get("city", {}).get("timezone", 0))
-        daily = defaultdict(lambda: {"temps": [], "icons": []})
-        for it in lst:
-            dl = datetime.utcfromtimestamp(it['dt'] + tz)
-            k = dl.strftime('%Y-%m-%d')
-            daily[k]['temps'].append(it['main']['temp'])
-            daily[k]['icons'].append(it['weather'][0]['id'])
-        unit = "C" if self.storage.settings.get("units") == "metric" else "F"
-        items = sorted(daily.items(), key=lambda kv: kv[0])[:5]
-        for i,(ds,data) in enumerate(items):
-            d = datetime.strptime(ds, '%Y-%m-%d')
-            name = "امروز" if i==0 else get_day_name_fa(d.weekday())
-            tmax = round(max(data['temps']))
-            tmin = round(min(data['temps']))
-            icon_code = data['icons'][len(data['icons'])//2]
+        daily: Dict[int, list] = {}
+        for idx, it in enumerate(lst):
+            k = (it['dt'] + tz) // 86400
+            t = it['main']['temp']
+            entry = daily.get(k)
+            if entry is None:
+                daily[k] = [t, t, idx, 1, (k + 3) % 7]
+                continue
+            if t < entry[0]: entry[0] = t
+            if t > entry[1]: entry[1] = t
+            entry[3] += 1
+        unit = self.temp_unit
+        items = sorted(daily.items())[:len(self.daily_widgets)]
+        for w in self.daily_widgets[len(items):]:
+            w.hide()
+        for i,(_,(lo,hi,start,n,wd)) in enumerate(items):
+            name = "امروز" if i==0 else FA_DAYS[wd]
+            tmax = round(hi)
+            tmin = round(lo)
+            icon_code = lst[start + n//2]['weather'][0]['id']
             icon = weather_emoji(icon_code)
-            w = DailyForecastWidget(name, icon, tmax, tmin, unit, self.colors)
-            self.daily_wrap.addWidget(w)
+            w = self.daily_widgets[i]
+            w.set_data(name, icon, tmax, tmin, unit)
+            w.show()
     def render_aqi(self, aqi: Optional[Dict[str, Any]]):
         if not self.storage.settings.get("show_aqi", True):
-            self.v7.setText("—")
+            set_label_text(self.aqi_lbl, "—")
             return
         if not aqi:
-            self.v7.setText("نامشخص")
+            set_label_text(self.aqi_lbl, "نامشخص")
             return
         try:
-            lvl = aqi['list'][0]['main']['aqi']
-            comp = aqi['list'][0]['components']
-            mp = {1:"1 (خوب)",2:"2 (قابل قبول)",3:"3 (متوسط)",4:"4 (بد)",5:"5 (خیلی بد)"}
-            self.v7.setText(f"{mp.get(lvl,str(lvl))}  |  PM2.5:{comp.get('pm2_5','?')}  PM10:{comp.get('pm10','?')}  O₃:{comp.get('o3','?')}")
+            c = aqi['list'][0]
+            lvl = c['main']['aqi']
+            comp = c['components']
+            pm25, pm10, o3 = comp.get('pm2_5','?'), comp.get('pm10','?'), comp.get('o3','?')
+            set_label_text(self.aqi_lbl, f"{AQI_LEVELS.get(lvl,str(lvl))}  |  PM2.5:{pm25}  PM10:{pm10}  O₃:{o3}")
         except Exception:
-            self.v7.setText("نامشخص")
+            set_label_text(self.aqi_lbl, "نامشخص")
     def clear_ui_on_error(self):
-        self.icon_lbl.setText("—"); self.temp_lbl.setText("—°"); self.city_lbl.setText("خطا در دریافت اطلاعات"); self.desc_lbl.setText("")
-        for v in (self.v1,self.v2,self.v3,self.v4,self.v5,self.v6,self.v7,self.v8): v.setText("—")
-        while self.daily_wrap.count():
-            it = self.daily_wrap.takeAt(0)
-            if it.widget(): it.widget().deleteLater()
+        set_label_text(self.icon_lbl, "—"); set_label_text(self.temp_lbl, "—°"); set_label_text(self.city_lbl, "خطا در دریافت اطلاعات"); set_label_text(self.desc_lbl, "")
+        for v in self.v: set_label_text(v, "—")
+        self.hide_daily()
     
 
 def main():